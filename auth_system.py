@@ -10,37 +10,309 @@ PA Audio Analyzer - ユーザー認証・管理システム
 
 import streamlit as st
 import hashlib
+import hmac
 import json
 import os
+import atexit
+import mmap
+import queue
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, compress
 from pathlib import Path
 from datetime import datetime
-import secrets
+from functools import lru_cache
+from heapq import nlargest
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from filelock import FileLock
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# パスワードハッシュ設定（Argon2id）
+# パラメータを引き上げた場合は、次回ログイン時に自動で再ハッシュされる
+_PH = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=4, hash_len=32)
+
+# 保存待ちのUserDatabase（ファイルパス -> インスタンス）
+_pending_saves = {}
+
+
+def _flush_pending_saves():
+    """保存待ちの変更を全て書き込み（終了時）"""
+    for db in list(_pending_saves.values()):
+        db.flush()
+
+
+atexit.register(_flush_pending_saves)
+
+# 解析データの書き込みキュー（バックグラウンドの1スレッドで順に保存）
+_write_queue = queue.Queue()
+
+
+def _write_worker():
+    """書き込みキューの処理を順に実行（結果・例外は各処理のFutureへ渡す）"""
+    while True:
+        func, args, future = _write_queue.get()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            _write_queue.task_done()
+
+
+threading.Thread(target=_write_worker, daemon=True).start()
+# 終了時は保存待ちの書き込みを全て完了させる
+atexit.register(_write_queue.join)
+
+
+if orjson is not None:
+    # NumPyのスカラー・配列（解析結果）をそのままシリアライズ
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _json_default(obj):
+    """標準jsonモジュール用: NumPyのスカラー・配列を変換"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_loads(data):
+    """JSONデコード（orjsonがあれば使用）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj):
+    """JSONエンコード（UTF-8バイト列、インデント2）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS | orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=_json_default).encode('utf-8')
+
+
+def _json_line(obj):
+    """JSON Lines用に1行分をエンコード（改行付きUTF-8バイト列）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj, ensure_ascii=False, default=_json_default).encode('utf-8') + b'\n'
+
+
+# このサイズ以上のJSON Linesファイルはメモリマップで読む
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def _iter_lines(path):
+    """ファイルを1行ずつ読む（大きいファイルはメモリマップ経由）"""
+    size = path.stat().st_size
+    
+    if size < MMAP_THRESHOLD:
+        yield from path.read_bytes().splitlines()
+        return
+    
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from iter(mm.readline, b'')
+
+
+def _iter_lines_reverse(path):
+    """ファイルを末尾から1行ずつ読む（メモリマップ経由）"""
+    if path.stat().st_size == 0:
+        return
+    
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = mm.size()
+        while end > 0:
+            start = mm.rfind(b'\n', 0, end - 1) + 1
+            yield mm[start:end]
+            end = start
+
+
+def _read_jsonl(path):
+    """JSON Linesファイル読み込み（壊れた行は読み飛ばす）"""
+    records = []
+    for line in _iter_lines(path):
+        try:
+            records.append(_json_loads(line))
+        except ValueError:
+            continue  # 空行・書き込み途中の行
+    return records
+
+
+def _write_jsonl(path, records):
+    """JSON Linesファイル書き込み（一時ファイル経由で置き換え）"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(b''.join(_json_line(r) for r in records))
+    tmp_path.replace(path)
+
+
+# 管理者画面で集計する主要指標
+METRIC_KEYS = ('rms_db', 'peak_db', 'stereo_width', 'crest_factor')
+
+# 管理者画面の一覧で1ページに詳細表示する件数
+PAGE_SIZE = 25
+
+
+@lru_cache(maxsize=8192)
+def fmt_ts(iso, fmt):
+    """ISO形式の日時文字列を表示用に整形（結果をキャッシュ）"""
+    return datetime.fromisoformat(iso).strftime(fmt)
+
+
+def _build_search_frame(records, fields):
+    """検索用に各フィールドを小文字化したDataFrameを作成"""
+    return pd.DataFrame({
+        column: pd.Series([getter(r) or '' for r in records], dtype=object).str.lower()
+        for column, getter in fields.items()
+    })
+
+
+def _contains(frame, column, search):
+    """小文字化済みの列に検索語を含む行のマスク"""
+    return frame[column].str.contains(search.lower(), regex=False, na=False)
+
+
+def summarize_metrics(metrics):
+    """主要指標の集計（指標 -> (平均, 中央値, 95パーセンタイル)、欠損値は除外）"""
+    summary = {}
+    for key, values in zip(METRIC_KEYS, metrics):
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            continue
+        median, p95 = np.percentile(values, [50, 95])
+        summary[key] = (float(values.mean()), float(median), float(p95))
+    return summary
+
+
+@lru_cache(maxsize=None)
+def _file_lock(path):
+    """ファイル単位のプロセス間ロック（複数ワーカーからの同時書き込み防止）"""
+    return FileLock(str(path) + '.lock')
+
+
+def _file_stamp(path):
+    """ファイル更新情報（更新時刻, サイズ）"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_json(path):
+    """JSONファイル読み込み（一括読み込み）"""
+    return _json_loads(path.read_bytes())
+
+
+def _write_json(path, obj):
+    """JSONファイル書き込み（一時ファイル経由で置き換え）"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(_json_dumps(obj))
+    tmp_path.replace(path)
 
 
 class UserDatabase:
     """ユーザーデータベース管理"""
     
+    # 書き込みをまとめる待ち時間（秒）
+    SAVE_DELAY = 1.0
+    
     def __init__(self, db_path='users.json'):
         self.db_path = Path(db_path)
         self.users = {}
+        self._key = self.db_path.resolve()
+        self._dirty = False
+        self._lock = threading.RLock()  # 変更（読み取り〜save()）と書き込みを排他
+        self._timer = None
+        self._generation = 0  # 変更のたびに増加
+        self._touched = set()  # 未保存の変更があるメールアドレス
+        self._stamp = None  # 最後に読み書きした時点のファイル更新情報
+        self._search_table = None  # (generation, ユーザー一覧, 検索用DataFrame)
         self.load()
     
     def load(self):
         """ユーザーデータ読み込み"""
+        # 別インスタンスの未保存の変更を先に書き込む
+        pending = _pending_saves.get(self._key)
+        if pending is not None and pending is not self:
+            pending.flush()
+        
         if self.db_path.exists():
             try:
-                with open(self.db_path, 'r', encoding='utf-8') as f:
-                    self.users = json.load(f)
+                self.users = _read_json(self.db_path)
             except:
                 self.users = {}
+            self._stamp = _file_stamp(self.db_path)
         else:
             # 初回起動時: デフォルト管理者アカウント作成
             self.create_default_admin()
     
-    def save(self):
-        """ユーザーデータ保存"""
-        with open(self.db_path, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+    def save(self, email=None):
+        """ユーザーデータ保存（SAVE_DELAY秒以内の書き込みはまとめて1回で保存）"""
+        with self._lock:
+            # 変更したユーザーのみ保存時にディスク上のデータへ反映（省略時は全ユーザー）
+            self._touched.update([email] if email is not None else self.users)
+            self._dirty = True
+            self._generation += 1
+            _pending_saves[self._key] = self
+            
+            if self._timer is None:
+                self._timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def flush(self):
+        """未保存の変更を即座に書き込み"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            
+            if self._dirty:
+                self._save_now()
+                self._dirty = False
+            
+            if _pending_saves.get(self._key) is self:
+                del _pending_saves[self._key]
+    
+    def _save_now(self):
+        """ユーザーデータをファイルへ書き込み（他ワーカーの変更を取り込んでから保存）"""
+        with _file_lock(self.db_path):
+            self._merge_from_disk()
+            _write_json(self.db_path, self.users)
+            self._stamp = _file_stamp(self.db_path)
+        self._touched.clear()
+    
+    def _merge_from_disk(self):
+        """ディスク上の最新データを取り込む（未保存の変更があるユーザーはそのまま）"""
+        try:
+            users = _read_json(self.db_path)
+        except (OSError, ValueError):
+            return
+        
+        # self.users を置き換えず同じ辞書を更新（参照中のユーザー情報への変更を失わない）
+        for email in [e for e in self.users if e not in users and e not in self._touched]:
+            del self.users[email]
+        for email, data in users.items():
+            if email not in self._touched:
+                self.users[email] = data
+        self._generation += 1
+    
+    def refresh(self):
+        """他ワーカーがファイルを更新していれば読み直す"""
+        with self._lock:
+            stamp = _file_stamp(self.db_path)
+            if stamp is not None and stamp != self._stamp:
+                self._merge_from_disk()
+                self._stamp = stamp
     
     def create_default_admin(self):
         """デフォルト管理者アカウント作成"""
@@ -59,66 +331,93 @@ class UserDatabase:
                 'bio': 'システム管理者'
             }
         }
-        self.save()
+        self.save(admin_email)
     
     def _hash_password(self, password):
-        """パスワードをハッシュ化（SHA-256 + Salt）"""
-        salt = secrets.token_hex(16)
-        pwd_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return f"{salt}:{pwd_hash}"
+        """パスワードをハッシュ化（Argon2id）"""
+        return _PH.hash(password)
     
     def _verify_password(self, password, stored_hash):
         """パスワード検証"""
+        if not stored_hash.startswith('$argon2'):
+            return self._verify_legacy_password(password, stored_hash)
+        
+        try:
+            return _PH.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    
+    def _verify_legacy_password(self, password, stored_hash):
+        """旧形式（SHA-256 + Salt）のパスワード検証"""
         try:
             salt, pwd_hash = stored_hash.split(':')
-            test_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-            return test_hash == pwd_hash
-        except:
+            # (password + salt) の連結文字列を作らずに同じダイジェストを計算
+            hasher = hashlib.sha256(password.encode())
+            hasher.update(salt.encode())
+            return hmac.compare_digest(hasher.hexdigest().encode(), pwd_hash.encode())
+        except ValueError:
             return False
     
+    def _needs_rehash(self, stored_hash):
+        """再ハッシュが必要か（旧形式・パラメータ変更時）"""
+        if not stored_hash.startswith('$argon2'):
+            return True
+        return _PH.check_needs_rehash(stored_hash)
+    
     def register_user(self, email, password, name, organization='', location=''):
         """新規ユーザー登録"""
+        self.refresh()
+        password_hash = self._hash_password(password)
         
-        # メールアドレス重複チェック
-        if email in self.users:
-            return False, "このメールアドレスは既に登録されています"
-        
-        # ユーザー作成
-        self.users[email] = {
-            'email': email,
-            'password_hash': self._hash_password(password),
-            'name': name,
-            'role': 'user',  # 一般ユーザー
-            'created_at': datetime.now().isoformat(),
-            'last_login': None,
-            'profile': {
-                'organization': organization,
-                'location': location,
-                'bio': ''
-            },
-            'stats': {
-                'total_analyses': 0,
-                'last_analysis_date': None
+        with self._lock:
+            # メールアドレス重複チェック
+            if email in self.users:
+                return False, "このメールアドレスは既に登録されています"
+            
+            # ユーザー作成
+            self.users[email] = {
+                'email': email,
+                'password_hash': password_hash,
+                'name': name,
+                'role': 'user',  # 一般ユーザー
+                'created_at': datetime.now().isoformat(),
+                'last_login': None,
+                'profile': {
+                    'organization': organization,
+                    'location': location,
+                    'bio': ''
+                },
+                'stats': {
+                    'total_analyses': 0,
+                    'last_analysis_date': None
+                }
             }
-        }
+            self.save(email)
         
-        self.save()
         return True, "登録が完了しました"
     
     def authenticate(self, email, password):
         """認証"""
+        self.refresh()
         
-        if email not in self.users:
+        user = self.users.get(email)
+        if user is None:
             return False, "メールアドレスまたはパスワードが正しくありません"
         
-        user = self.users[email]
-        
         if not self._verify_password(password, user['password_hash']):
             return False, "メールアドレスまたはパスワードが正しくありません"
         
-        # ログイン成功 - 最終ログイン更新
-        self.users[email]['last_login'] = datetime.now().isoformat()
-        self.save()
+        # ログイン成功 - 旧形式・旧パラメータのハッシュを更新（ハッシュ計算はロック外で）
+        new_hash = self._hash_password(password) if self._needs_rehash(user['password_hash']) else None
+        
+        with self._lock:
+            user = self.users.get(email, user)
+            if new_hash is not None:
+                user['password_hash'] = new_hash
+            
+            # 最終ログイン更新
+            user['last_login'] = datetime.now().isoformat()
+            self.save(email)
         
         return True, user
     
@@ -128,37 +427,62 @@ class UserDatabase:
     
     def update_user_stats(self, email):
         """ユーザー統計更新（解析実行時）"""
-        if email in self.users:
-            self.users[email]['stats']['total_analyses'] += 1
-            self.users[email]['stats']['last_analysis_date'] = datetime.now().isoformat()
-            self.save()
+        with self._lock:
+            user = self.users.get(email)
+            if user is None:
+                return
+            
+            stats = user['stats']
+            stats['total_analyses'] += 1
+            stats['last_analysis_date'] = datetime.now().isoformat()
+            self.save(email)
     
     def get_all_users(self):
         """全ユーザー取得（管理者用）"""
         return list(self.users.values())
     
-    def update_profile(self, email, profile_data):
-        """プロフィール更新"""
-        if email in self.users:
-            self.users[email]['profile'].update(profile_data)
-            self.save()
-            return True
-        return False
+    def get_user_search_table(self):
+        """検索用のユーザー一覧と小文字化済みDataFrame（変更がなければ再利用）"""
+        if self._search_table is None or self._search_table[0] != self._generation:
+            users = self.get_all_users()
+            frame = _build_search_frame(users, {
+                'email': lambda u: u['email'],
+                'name': lambda u: u['name'],
+                'organization': lambda u: u['profile'].get('organization', '')
+            })
+            self._search_table = (self._generation, users, frame)
+        
+        return self._search_table[1], self._search_table[2]
+    
+    def update_profile(self, email, profile_data, name=None):
+        """プロフィール更新（name指定時は表示名も更新）"""
+        with self._lock:
+            user = self.users.get(email)
+            if user is None:
+                return False
+            
+            if name is not None:
+                user['name'] = name
+            user['profile'].update(profile_data)
+            self.save(email)
+        return True
     
     def change_password(self, email, old_password, new_password):
         """パスワード変更"""
-        if email not in self.users:
+        user = self.users.get(email)
+        if user is None:
             return False, "ユーザーが見つかりません"
         
-        user = self.users[email]
-        
         # 旧パスワード確認
         if not self._verify_password(old_password, user['password_hash']):
             return False, "現在のパスワードが正しくありません"
         
-        # 新パスワード設定
-        self.users[email]['password_hash'] = self._hash_password(new_password)
-        self.save()
+        # 新パスワード設定（ハッシュ計算はロック外で）
+        new_hash = self._hash_password(new_password)
+        with self._lock:
+            user = self.users.get(email, user)
+            user['password_hash'] = new_hash
+            self.save(email)
         
         return True, "パスワードを変更しました"
 
@@ -166,41 +490,138 @@ class UserDatabase:
 class UserAudioDatabase:
     """ユーザー別音源データベース"""
     
+    # このサイズ以下のファイルは削除時に即座に書き直す（超える場合は削除マークを追記）
+    COMPACT_SIZE = 1024 * 1024
+    
     def __init__(self, db_path='user_audio_data'):
         self.db_dir = Path(db_path)
         self.db_dir.mkdir(exist_ok=True)
+        
+        # 読み込み済みファイルのキャッシュ（パス -> (更新情報, 解析データ)）
+        self._file_cache = {}
+        # 管理者用一覧のキャッシュ（(全ファイルの更新情報, 解析データ)）
+        self._admin_cache = None
+        # 管理者用一覧から作る検索用DataFrame・指標（(元の解析データ, DataFrame, 指標)）
+        self._admin_table = None
+        
+        # 集計値（総解析数）
+        self.stats_path = self.db_dir / '_stats.json'
+        
+        # 旧形式（{"analyses": [...]} のJSON）のファイルを変換
+        for legacy_path in self.db_dir.glob('*.json'):
+            if legacy_path != self.stats_path:
+                self._migrate_legacy_file(legacy_path)
+        
+        # 全ユーザーの解析一覧インデックス（追記専用、1行1件）
+        self.index_path = self.db_dir / '_index.jsonl'
+        if not self.index_path.exists():
+            self._rebuild_index()
+        
+        with _file_lock(self.stats_path):
+            if self.stats_path.exists():
+                self._stats = _read_json(self.stats_path)
+            else:
+                self._stats = {'total': len(self.get_all_analyses_for_admin())}
+                _write_json(self.stats_path, self._stats)
+        self._stats_stamp = _file_stamp(self.stats_path)
     
     def _get_user_db_path(self, email):
-        """ユーザー別DBファイルパス"""
-        # メールアドレスをファイル名として使用（安全にエンコード）
+        """ユーザー別DBファイルパス（JSON Lines、1行目にメールアドレス、以降1行1解析）"""
+        # メールアドレスのハッシュをファイル名に使用（衝突・不正文字なし）
+        digest = hashlib.blake2b(email.encode('utf-8'), digest_size=16).hexdigest()
+        db_path = self.db_dir / f"{digest}.jsonl"
+        
+        # 旧形式のファイル名から移行
+        legacy_path = self._legacy_db_path(email)
+        if legacy_path.exists():
+            with _file_lock(db_path):
+                if not legacy_path.exists():
+                    return db_path  # 他ワーカーが移行済み
+                
+                analyses = self._live_analyses(_read_jsonl(legacy_path))
+                if db_path.exists():
+                    analyses = self._live_analyses(_read_jsonl(db_path)) + analyses
+                
+                _write_jsonl(db_path, [{'_email': email}] + analyses)
+                legacy_path.unlink()
+            self._file_cache.pop(db_path, None)
+            self._file_cache.pop(legacy_path, None)
+            
+            # ファイル名から復元したメールアドレスが異なる場合はインデックスを訂正
+            decoded_email = legacy_path.stem.replace('_at_', '@').replace('_', '.')
+            if decoded_email != email:
+                for analysis in analyses:
+                    self._append_index({'deleted': analysis['id'], 'user_email': decoded_email})
+                    self._append_index(self._index_record(email, analysis))
+        
+        return db_path
+    
+    def _legacy_db_path(self, email):
+        """旧形式のユーザー別DBファイルパス（メールアドレスを置換したファイル名）"""
         safe_email = email.replace('@', '_at_').replace('.', '_')
-        return self.db_dir / f"{safe_email}.json"
+        return self.db_dir / f"{safe_email}.jsonl"
     
-    def add_analysis(self, email, analysis_data, metadata):
-        """解析データ追加"""
+    def _user_db_files(self):
+        """全ユーザーのDBファイル"""
+        return sorted(p for p in self.db_dir.glob('*.jsonl') if p != self.index_path)
+    
+    def _migrate_legacy_file(self, legacy_path):
+        """旧形式のJSONファイルをJSON Linesに変換"""
+        db_path = legacy_path.with_suffix('.jsonl')
         
-        db_path = self._get_user_db_path(email)
+        with _file_lock(db_path):
+            if not legacy_path.exists():
+                return  # 他ワーカーが移行済み
+            
+            try:
+                data = _read_json(legacy_path)
+            except:
+                return
+            
+            records = data.get('analyses', [])
+            if db_path.exists():
+                records = _read_jsonl(db_path) + records
+            
+            _write_jsonl(db_path, records)
+            legacy_path.unlink(missing_ok=True)
+    
+    def _live_analyses(self, records):
+        """削除マークを反映した有効な解析データ（ファイル順）"""
+        entries = []
+        deleted = {}  # 削除された解析ID -> 削除マークの位置
         
-        # 既存データ読み込み
-        if db_path.exists():
-            with open(db_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        else:
-            data = {'analyses': []}
+        for pos, record in enumerate(records):
+            if '_email' in record:
+                continue  # ヘッダー行
+            elif '_deleted' in record:
+                deleted[record['_deleted']] = pos
+            else:
+                entries.append((pos, record))
+        
+        return [record for pos, record in entries if deleted.get(record['id'], -1) < pos]
+    
+    def add_analysis(self, email, analysis_data, metadata, entry_id=None):
+        """解析データ追加（entry_id省略時は日時から採番）"""
+        
+        db_path = self._get_user_db_path(email)
         
         # 新規エントリ追加
         entry = {
-            'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
+            'id': entry_id or datetime.now().strftime('%Y%m%d_%H%M%S'),
             'timestamp': datetime.now().isoformat(),
             'metadata': metadata,
             'analysis': analysis_data
         }
         
-        data['analyses'].append(entry)
+        # 保存（末尾に1行追記、新規ファイルはメールアドレスを先頭に記録）
+        with _file_lock(db_path), open(db_path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(_json_line({'_email': email}))
+            f.write(_json_line(entry))
+        self._file_cache.pop(db_path, None)
         
-        # 保存
-        with open(db_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._append_index(self._index_record(email, entry))
+        self._update_total(1)
         
         return entry['id']
     
@@ -212,16 +633,13 @@ class UserAudioDatabase:
         if not db_path.exists():
             return []
         
-        with open(db_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        analyses = data.get('analyses', [])
-        
-        # 新しい順にソート
-        analyses.sort(key=lambda x: x['timestamp'], reverse=True)
+        analyses = self._live_analyses(_read_jsonl(db_path))
         
+        # 新しい順（件数指定時は上位のみ選択し、全体はソートしない）
         if limit:
-            return analyses[:limit]
+            return nlargest(limit, analyses, key=itemgetter('timestamp'))
+        
+        analyses.sort(key=itemgetter('timestamp'), reverse=True)
         
         return analyses
     
@@ -233,43 +651,264 @@ class UserAudioDatabase:
         if not db_path.exists():
             return False
         
-        with open(db_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # 読み込みから書き込みまでの間に他ワーカーが追記しないようロック
+        with _file_lock(db_path):
+            records = _read_jsonl(db_path)
+            analyses = self._live_analyses(records)
+            
+            # 該当データを削除
+            remaining = [a for a in analyses if a['id'] != analysis_id]
+            
+            if len(remaining) == len(analyses):
+                return False
+            
+            # 小さいファイル、または削除済みの行が半分を超えたら書き直す
+            dead_lines = len(records) - len(remaining)
+            if db_path.stat().st_size <= self.COMPACT_SIZE or dead_lines * 2 > len(records):
+                _write_jsonl(db_path, [{'_email': email}] + remaining)
+            else:
+                with open(db_path, 'ab') as f:
+                    f.write(_json_line({'_deleted': analysis_id}))
         
-        # 該当データを削除
-        original_count = len(data['analyses'])
-        data['analyses'] = [a for a in data['analyses'] if a['id'] != analysis_id]
+        self._file_cache.pop(db_path, None)
+        self._append_index({'deleted': analysis_id, 'user_email': email})
+        self._update_total(len(remaining) - len(analyses))
+        return True
+    
+    def _update_total(self, delta):
+        """総解析数を更新して保存（他ワーカーの更新を読み直してから加算）"""
+        with _file_lock(self.stats_path):
+            self._refresh_stats()
+            self._stats['total'] = max(0, self._stats['total'] + delta)
+            _write_json(self.stats_path, self._stats)
+            self._stats_stamp = _file_stamp(self.stats_path)
+    
+    def _refresh_stats(self):
+        """集計ファイルが他ワーカーに更新されていれば読み直す"""
+        stamp = _file_stamp(self.stats_path)
+        if stamp is not None and stamp != self._stats_stamp:
+            try:
+                self._stats = _read_json(self.stats_path)
+                self._stats_stamp = stamp
+            except ValueError:
+                pass
+    
+    def get_total_count(self):
+        """全ユーザーの総解析数"""
+        self._refresh_stats()
+        return self._stats['total']
+    
+    def _load_user_file(self, db_file):
+        """ユーザー別DBファイルを読み込み、ユーザー情報付きの解析データを返す"""
+        stamp = _file_stamp(db_file)
         
-        if len(data['analyses']) < original_count:
-            with open(db_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return True
+        # 前回読み込みから変更がなければキャッシュを返す
+        cached = self._file_cache.get(db_file)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        try:
+            records = _read_jsonl(db_file)
+        except OSError:
+            return []
+        
+        # メールアドレス（旧形式のファイルはファイル名から復元）
+        if records and '_email' in records[0]:
+            email = records[0]['_email']
+        else:
+            email = db_file.stem.replace('_at_', '@').replace('_', '.')
+        
+        analyses = self._live_analyses(records)
         
-        return False
+        for analysis in analyses:
+            analysis['user_email'] = email
+        
+        self._file_cache[db_file] = (stamp, analyses)
+        
+        return analyses
+    
+    def get_all_analyses_for_admin(self, limit=None):
+        """全ユーザーの解析データ取得（管理者用、新しい順）"""
+        
+        db_files = self._user_db_files()
+        
+        # どのファイルも変更されていなければ前回の結果を返す
+        fingerprint = tuple((f, _file_stamp(f)) for f in db_files)
+        if self._admin_cache is not None and self._admin_cache[0] == fingerprint:
+            return self._admin_cache[1][:limit]
+        
+        # ファイル読み込みはI/O待ちが中心のため並列化
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._load_user_file, db_files)
+            all_analyses = list(chain.from_iterable(results))
+        
+        # 新しい順にソート
+        all_analyses.sort(key=itemgetter('timestamp'), reverse=True)
+        
+        self._admin_cache = (fingerprint, all_analyses)
+        
+        return all_analyses[:limit]
+    
+    def get_admin_search_table(self):
+        """全解析データ・検索用の小文字化済みDataFrame・主要指標（変更がなければ再利用）
+
+        3つとも同じ時点の一覧から作成するため、行の並び・件数は常に一致する。
+        主要指標は METRIC_KEYS × 解析数（一覧と同じ並び、欠損はNaN）
+        """
+        self.get_all_analyses_for_admin()
+        
+        # 途中で他の処理がキャッシュを更新しても、ここで取り出した一覧だけを使う
+        all_analyses = self._admin_cache[1]
+        
+        table = self._admin_table
+        if table is None or table[0] is not all_analyses:
+            search_frame = _build_search_frame(all_analyses, {
+                'user_email': lambda a: a.get('user_email', ''),
+                'analysis_name': lambda a: a['metadata'].get('analysis_name', ''),
+                'venue': lambda a: a['metadata'].get('venue', '')
+            })
+            
+            count = len(all_analyses)
+            metrics = np.fromiter(
+                (a.get('analysis', {}).get(key, np.nan) for key in METRIC_KEYS for a in all_analyses),
+                dtype=np.float32,
+                count=len(METRIC_KEYS) * count
+            ).reshape(len(METRIC_KEYS), count)
+            
+            table = (all_analyses, search_frame, metrics)
+            self._admin_table = table
+        
+        return table
+    
+    def _index_record(self, email, entry):
+        """インデックス用の要約レコード"""
+        return {
+            'timestamp': entry['timestamp'],
+            'user_email': email,
+            'id': entry['id'],
+            'analysis_name': entry['metadata'].get('analysis_name'),
+            'venue': entry['metadata'].get('venue')
+        }
     
-    def get_all_analyses_for_admin(self):
-        """全ユーザーの解析データ取得（管理者用）"""
+    def _append_index(self, record):
+        """インデックスに1行追記"""
+        with _file_lock(self.index_path), open(self.index_path, 'ab') as f:
+            f.write(_json_line(record))
+    
+    def _rebuild_index(self):
+        """既存の解析データからインデックスを作成"""
+        with _file_lock(self.index_path):
+            if self.index_path.exists():
+                return  # 他ワーカーが作成済み
+            
+            analyses = self.get_all_analyses_for_admin()
+            analyses.reverse()  # 古い順に記録
+            
+            _write_jsonl(self.index_path, [
+                self._index_record(a['user_email'], a) for a in analyses
+            ])
+    
+    def get_recent_analyses(self, limit=None):
+        """最近の解析の要約を取得（インデックスのみ参照、新しい順）"""
+        
+        if limit:
+            return self._tail_index(limit)
         
-        all_analyses = []
+        entries = {}
         
-        for db_file in self.db_dir.glob('*.json'):
+        for line in _iter_lines(self.index_path):
             try:
-                with open(db_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # メールアドレス復元
-                email = db_file.stem.replace('_at_', '@').replace('_', '.')
-                
-                for analysis in data.get('analyses', []):
-                    analysis['user_email'] = email
-                    all_analyses.append(analysis)
-            except:
+                record = _json_loads(line)
+            except ValueError:
+                continue  # 空行・書き込み途中の行
+            
+            if 'deleted' in record:
+                entries.pop((record['user_email'], record['deleted']), None)
+            else:
+                entries[(record['user_email'], record['id'])] = record
+        
+        return sorted(entries.values(), key=itemgetter('timestamp'), reverse=True)
+    
+    def _tail_index(self, limit):
+        """インデックス末尾から最新limit件を読む（ファイル全体は読まない）"""
+        
+        recent = []
+        seen = set()  # 取得済み・削除済みの (メール, ID)
+        
+        for line in _iter_lines_reverse(self.index_path):
+            try:
+                record = _json_loads(line)
+            except ValueError:
+                continue  # 空行・書き込み途中の行
+            
+            if 'deleted' in record:
+                seen.add((record['user_email'], record['deleted']))
+                continue
+            
+            key = (record['user_email'], record['id'])
+            if key in seen:
                 continue
+            
+            seen.add(key)
+            recent.append(record)
+            
+            if len(recent) >= limit:
+                break
         
-        # 新しい順にソート
-        all_analyses.sort(key=lambda x: x['timestamp'], reverse=True)
+        recent.sort(key=itemgetter('timestamp'), reverse=True)
         
-        return all_analyses
+        return recent
+
+
+@st.cache_resource
+def get_user_db():
+    """ユーザーデータベース（プロセス内で共有し、リラン毎の再読み込みを避ける）"""
+    return UserDatabase()
+
+
+@st.cache_resource
+def get_audio_db():
+    """音源データベース（プロセス内で共有）"""
+    return UserAudioDatabase()
+
+
+@st.cache_data(ttl=300)
+def load_user_analyses(_audio_db, email):
+    """ユーザーの解析データ取得（キャッシュ付き、追加・削除時は clear() すること）"""
+    return _audio_db.get_user_analyses(email)
+
+
+def _add_analysis_task(user_db, audio_db, email, analysis_data, metadata, entry_id):
+    """解析データを保存し、ユーザー統計を更新（書き込みスレッドで実行）"""
+    audio_db.add_analysis(email, analysis_data, metadata, entry_id=entry_id)
+    # 保存に成功した場合のみ解析数を加算
+    user_db.update_user_stats(email)
+    load_user_analyses.clear()
+    return entry_id
+
+
+def save_analysis_async(user_db, audio_db, email, analysis_data, metadata):
+    """解析データの保存をバックグラウンドで実行（戻り値のFutureは保存後に解析IDを返す）"""
+    future = Future()
+    entry_id = uuid.uuid4().hex
+    _write_queue.put((_add_analysis_task, (user_db, audio_db, email, analysis_data, metadata, entry_id), future))
+    return future
+
+
+def show_save_status():
+    """バックグラウンド保存の結果を表示（完了したものはセッションから削除）"""
+    pending = []
+    
+    for future in st.session_state.pending_saves:
+        if not future.done():
+            pending.append(future)
+        elif future.exception() is not None:
+            st.warning(f"⚠️ 解析データを保存できませんでした: {future.exception()}")
+        else:
+            st.success(f"💾 解析データを保存しました（ID: {future.result()}）")
+    
+    st.session_state.pending_saves = pending
 
 
 def init_session_state():
@@ -283,6 +922,9 @@ def init_session_state():
     
     if 'page' not in st.session_state:
         st.session_state.page = 'login'
+    
+    if 'pending_saves' not in st.session_state:
+        st.session_state.pending_saves = []  # 保存中の解析データ（Future）
 
 
 def show_login_page(user_db):
@@ -389,10 +1031,10 @@ def show_user_profile(user_db):
     with st.form("profile_form"):
         st.markdown("### 基本情報")
         st.text_input("メールアドレス", value=user['email'], disabled=True)
-        st.text_input("登録日", value=datetime.fromisoformat(user['created_at']).strftime('%Y年%m月%d日'), disabled=True)
+        st.text_input("登録日", value=fmt_ts(user['created_at'], '%Y年%m月%d日'), disabled=True)
         
         if user.get('last_login'):
-            st.text_input("最終ログイン", value=datetime.fromisoformat(user['last_login']).strftime('%Y年%m月%d日 %H:%M'), disabled=True)
+            st.text_input("最終ログイン", value=fmt_ts(user['last_login'], '%Y年%m月%d日 %H:%M'), disabled=True)
         
         st.markdown("### プロフィール編集")
         
@@ -402,12 +1044,11 @@ def show_user_profile(user_db):
         bio = st.text_area("自己紹介", value=user['profile'].get('bio', ''), height=100)
         
         if st.form_submit_button("更新", type="primary"):
-            user_db.users[user['email']]['name'] = name
             user_db.update_profile(user['email'], {
                 'organization': organization,
                 'location': location,
                 'bio': bio
-            })
+            }, name=name)
             
             # セッションステート更新
             st.session_state.user = user_db.get_user(user['email'])
@@ -455,7 +1096,7 @@ def show_user_profile(user_db):
     with col2:
         last_analysis = stats.get('last_analysis_date')
         if last_analysis:
-            st.metric("最終解析日", datetime.fromisoformat(last_analysis).strftime('%Y/%m/%d'))
+            st.metric("最終解析日", fmt_ts(last_analysis, '%Y/%m/%d'))
         else:
             st.metric("最終解析日", "未実施")
 
@@ -483,7 +1124,7 @@ def show_admin_stats(user_db, audio_db):
     st.markdown("### 📊 システム統計")
     
     users = user_db.get_all_users()
-    all_analyses = audio_db.get_all_analyses_for_admin()
+    total_analyses = audio_db.get_total_count()
     
     # サマリーメトリクス
     col1, col2, col3, col4 = st.columns(4)
@@ -492,15 +1133,15 @@ def show_admin_stats(user_db, audio_db):
         st.metric("総ユーザー数", len(users))
     
     with col2:
-        st.metric("総解析数", len(all_analyses))
+        st.metric("総解析数", total_analyses)
     
     with col3:
         active_users = len([u for u in users if u.get('stats', {}).get('total_analyses', 0) > 0])
         st.metric("アクティブユーザー", active_users)
     
     with col4:
-        if all_analyses:
-            avg_per_user = len(all_analyses) / max(len(users), 1)
+        if total_analyses:
+            avg_per_user = total_analyses / max(len(users), 1)
             st.metric("ユーザーあたり平均解析数", f"{avg_per_user:.1f}")
         else:
             st.metric("ユーザーあたり平均解析数", "0.0")
@@ -510,16 +1151,16 @@ def show_admin_stats(user_db, audio_db):
     # 最近のアクティビティ
     st.markdown("### 🕐 最近のアクティビティ")
     
-    if all_analyses:
-        recent = all_analyses[:10]
-        
+    recent = audio_db.get_recent_analyses(limit=10)
+    
+    if recent:
         for analysis in recent:
-            timestamp = datetime.fromisoformat(analysis['timestamp'])
-            name = analysis['metadata'].get('analysis_name', '名称未設定')
+            timestamp = analysis['timestamp']
+            name = analysis.get('analysis_name') or '名称未設定'
             user_email = analysis.get('user_email', '不明')
             
             st.markdown(f"""
-            **{timestamp.strftime('%Y/%m/%d %H:%M')}** - {user_email}  
+            **{fmt_ts(timestamp, '%Y/%m/%d %H:%M')}** - {user_email}  
             📝 {name}
             """)
             st.markdown("---")
@@ -527,26 +1168,47 @@ def show_admin_stats(user_db, audio_db):
         st.info("まだ解析データがありません")
 
 
+def _paginate(items, label):
+    """一覧をPAGE_SIZE件ずつに分割し、選択中のページの要素を返す"""
+    pages = max(1, (len(items) + PAGE_SIZE - 1) // PAGE_SIZE)
+    
+    if pages == 1:
+        return items
+    
+    # ページ数が変わったら（検索条件の変更など）1ページ目に戻す
+    page = st.number_input(
+        f"{label}（全{pages}ページ）",
+        min_value=1,
+        max_value=pages,
+        value=1,
+        step=1,
+        key=f"{label}_page_{pages}"
+    )
+    
+    start = (page - 1) * PAGE_SIZE
+    return items[start:start + PAGE_SIZE]
+
+
 def show_admin_users(user_db):
     """管理者ユーザー管理ページ"""
     
     st.markdown("### 👥 ユーザー一覧")
     
-    users = user_db.get_all_users()
+    users, search_frame = user_db.get_user_search_table()
     
     # 検索・フィルター
     search = st.text_input("🔍 検索", placeholder="メールアドレス、名前、所属で検索")
     
     # フィルタリング
     if search:
-        filtered_users = [
-            u for u in users
-            if search.lower() in u['email'].lower()
-            or search.lower() in u['name'].lower()
-            or search.lower() in u['profile'].get('organization', '').lower()
-        ]
+        mask = (
+            _contains(search_frame, 'email', search)
+            | _contains(search_frame, 'name', search)
+            | _contains(search_frame, 'organization', search)
+        )
+        filtered_users = list(compress(users, mask))
     else:
-        filtered_users = users
+        filtered_users = list(users)
     
     # 統計でソート
     filtered_users.sort(
@@ -556,8 +1218,26 @@ def show_admin_users(user_db):
     
     st.write(f"**表示: {len(filtered_users)}人 / 全{len(users)}人**")
     
-    # ユーザー一覧表示
-    for user in filtered_users:
+    # 一覧表（1ウィジェットで全件表示）
+    st.dataframe(
+        pd.DataFrame({
+            '名前': [u['name'] for u in filtered_users],
+            'メール': [u['email'] for u in filtered_users],
+            '権限': [u['role'] for u in filtered_users],
+            '総解析数': [u.get('stats', {}).get('total_analyses', 0) for u in filtered_users],
+            '最終ログイン': [
+                fmt_ts(u['last_login'], '%Y/%m/%d %H:%M') if u.get('last_login') else ''
+                for u in filtered_users
+            ]
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # ユーザー詳細（ページ単位で表示）
+    st.markdown("#### ユーザー詳細")
+    
+    for user in _paginate(filtered_users, "ユーザー詳細ページ"):
         with st.expander(
             f"{'🛡️ ' if user['role'] == 'admin' else '👤 '}{user['name']} ({user['email']})",
             expanded=False
@@ -569,10 +1249,10 @@ def show_admin_users(user_db):
                 st.write(f"**メール**: {user['email']}")
                 st.write(f"**名前**: {user['name']}")
                 st.write(f"**権限**: {user['role']}")
-                st.write(f"**登録日**: {datetime.fromisoformat(user['created_at']).strftime('%Y/%m/%d')}")
+                st.write(f"**登録日**: {fmt_ts(user['created_at'], '%Y/%m/%d')}")
                 
                 if user.get('last_login'):
-                    st.write(f"**最終ログイン**: {datetime.fromisoformat(user['last_login']).strftime('%Y/%m/%d %H:%M')}")
+                    st.write(f"**最終ログイン**: {fmt_ts(user['last_login'], '%Y/%m/%d %H:%M')}")
             
             with col2:
                 st.markdown("**プロフィール**")
@@ -587,7 +1267,7 @@ def show_admin_users(user_db):
                 st.write(f"**総解析数**: {stats.get('total_analyses', 0)}")
                 
                 if stats.get('last_analysis_date'):
-                    st.write(f"**最終解析**: {datetime.fromisoformat(stats['last_analysis_date']).strftime('%Y/%m/%d')}")
+                    st.write(f"**最終解析**: {fmt_ts(stats['last_analysis_date'], '%Y/%m/%d')}")
 
 
 def show_admin_audio(audio_db):
@@ -595,7 +1275,7 @@ def show_admin_audio(audio_db):
     
     st.markdown("### 🎵 アップロード音源一覧")
     
-    all_analyses = audio_db.get_all_analyses_for_admin()
+    all_analyses, search_frame, metrics = audio_db.get_admin_search_table()
     
     if not all_analyses:
         st.info("まだアップロードされた音源がありません")
@@ -614,35 +1294,75 @@ def show_admin_audio(audio_db):
         search_venue = st.text_input("会場で検索", placeholder="会場名")
     
     # フィルタリング
-    filtered = all_analyses
+    mask = pd.Series(True, index=search_frame.index)
     
     if search_user:
-        filtered = [a for a in filtered if search_user.lower() in a.get('user_email', '').lower()]
+        mask &= _contains(search_frame, 'user_email', search_user)
     
     if search_name:
-        filtered = [a for a in filtered if search_name.lower() in a['metadata'].get('analysis_name', '').lower()]
+        mask &= _contains(search_frame, 'analysis_name', search_name)
     
     if search_venue:
-        filtered = [a for a in filtered if search_venue.lower() in a['metadata'].get('venue', '').lower()]
+        mask &= _contains(search_frame, 'venue', search_venue)
+    
+    filtered = list(compress(all_analyses, mask))
     
     st.write(f"**表示: {len(filtered)}件 / 全{len(all_analyses)}件**")
     
-    # 音源一覧表示
-    for analysis in filtered:
-        timestamp = datetime.fromisoformat(analysis['timestamp'])
+    # 表示中の解析の指標サマリー
+    summary = summarize_metrics(metrics[:, mask.to_numpy()])
+    
+    if summary:
+        st.markdown("**📈 指標サマリー（表示中の解析）**")
+        
+        labels = {
+            'rms_db': ("平均RMS", "dB"),
+            'peak_db': ("平均Peak", "dB"),
+            'stereo_width': ("平均ステレオ幅", "%"),
+            'crest_factor': ("平均クレスト", "dB")
+        }
+        
+        for col, key in zip(st.columns(len(METRIC_KEYS)), METRIC_KEYS):
+            if key not in summary:
+                continue
+            mean, median, p95 = summary[key]
+            label, unit = labels[key]
+            with col:
+                st.metric(label, f"{mean:.1f} {unit}",
+                         delta=f"中央値 {median:.1f} / 95% {p95:.1f}", delta_color="off")
+    
+    # 一覧表（1ウィジェットで全件表示）
+    st.dataframe(
+        pd.DataFrame({
+            '日時': [fmt_ts(a['timestamp'], '%Y/%m/%d %H:%M') for a in filtered],
+            'ユーザー': [a.get('user_email', '不明') for a in filtered],
+            '解析名': [a['metadata'].get('analysis_name', '名称未設定') for a in filtered],
+            '会場': [a['metadata'].get('venue', '不明') for a in filtered],
+            'RMS (dB)': [a.get('analysis', {}).get('rms_db') for a in filtered],
+            'Peak (dB)': [a.get('analysis', {}).get('peak_db') for a in filtered]
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # 音源詳細（ページ単位で表示）
+    st.markdown("#### 音源詳細")
+    
+    for analysis in _paginate(filtered, "音源詳細ページ"):
+        timestamp = analysis['timestamp']
         name = analysis['metadata'].get('analysis_name', '名称未設定')
         user_email = analysis.get('user_email', '不明')
         venue = analysis['metadata'].get('venue', '不明')
         
         with st.expander(
-            f"🎵 {name} - {user_email} ({timestamp.strftime('%Y/%m/%d %H:%M')})",
+            f"🎵 {name} - {user_email} ({fmt_ts(timestamp, '%Y/%m/%d %H:%M')})",
             expanded=False
         ):
             col1, col2 = st.columns(2)
             
             with col1:
                 st.markdown("**📅 基本情報**")
-                st.write(f"**アップロード日時**: {timestamp.strftime('%Y年%m月%d日 %H:%M')}")
+                st.write(f"**アップロード日時**: {fmt_ts(timestamp, '%Y年%m月%d日 %H:%M')}")
                 st.write(f"**ユーザー**: {user_email}")
                 st.write(f"**解析名**: {name}")
                 st.write(f"**ID**: {analysis['id']}")
@@ -16,25 +16,37 @@ PA Audio Analyzer V3.0 - 完全統合版
 import streamlit as st
 import numpy as np
 import librosa
+import soundfile as sf
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from scipy import signal
+from scipy import fft as sp_fft
 from scipy.stats import pearsonr
 import io
 from pathlib import Path
 import tempfile
 import json
-from datetime import datetime
 import os
 import sys
+import math
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# 数値計算カーネルのJITコンパイル（numbaがない環境ではNumPy実装を使用）
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
 
 # 認証システムをインポート
 # auth_system.py が同じディレクトリにあること
 try:
     from auth_system import (
-        UserDatabase, UserAudioDatabase,
-        init_session_state,
+        get_user_db, get_audio_db, load_user_analyses, save_analysis_async, show_save_status,
+        init_session_state, fmt_ts,
         show_login_page, show_register_page,
         show_user_profile, show_admin_dashboard
     )
@@ -101,34 +113,260 @@ st.markdown("""
 # 音源解析エンジン（pa_analyzer_v3_finalから移植）
 # =====================================
 
+# dB変換（20*log10(x) = _DB_COEF*ln(x)）、_EPS以下は下限値として扱う
+# _EPSはfloat32とし、float32配列との演算でfloat64へ昇格させない
+_EPS = np.float32(1e-10)
+_DB_COEF = 20 / math.log(10)
+
+
+def _to_db(x):
+    """振幅値をdBに変換（スカラー・配列どちらも可）"""
+    if np.ndim(x) == 0:
+        return _DB_COEF * math.log(max(float(x), _EPS))
+    
+    # 一時配列は1つだけ作成し、以降は同じ配列上で計算
+    db = np.maximum(x, _EPS)
+    np.log(db, out=db)
+    db *= _DB_COEF
+    return db
+
+
+if HAS_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def _peak_and_rms(x):
+        """ピーク値とRMS値を1パスで計算"""
+        peak = 0.0
+        sum_sq = 0.0
+        for i in range(x.shape[0]):
+            v = x[i]
+            a = abs(v)
+            if a > peak:
+                peak = a
+            sum_sq += v * v
+        return peak, math.sqrt(sum_sq / x.shape[0])
+else:
+    def _peak_and_rms(x):
+        """ピーク値とRMS値を計算"""
+        return float(np.max(np.abs(x))), float(np.sqrt(np.mean(x ** 2)))
+
+
+if HAS_NUMBA:
+    # parallel=True は使わない（Streamlitのスクリプトスレッドから並列カーネルを起動すると、
+    # TBBスレッド層では終了時にプロセスが停止しないため）
+    @njit(cache=True, fastmath=True)
+    def _block_stats(x, hop_length):
+        """hop_length単位のブロックごとのピーク値と二乗和"""
+        n = x.shape[0]
+        n_blocks = (n + hop_length - 1) // hop_length
+        block_peak = np.zeros(n_blocks)
+        block_sq = np.zeros(n_blocks)
+        for b in range(n_blocks):
+            start = b * hop_length
+            end = min(start + hop_length, n)
+            peak = 0.0
+            sum_sq = 0.0
+            for i in range(start, end):
+                v = float(x[i])
+                a = abs(v)
+                if a > peak:
+                    peak = a
+                sum_sq += v * v
+            block_peak[b] = peak
+            block_sq[b] = sum_sq
+        return block_peak, block_sq
+else:
+    def _block_stats(x, hop_length):
+        """hop_length単位のブロックごとのピーク値と二乗和"""
+        # 端数を除いた部分はコピーせずブロックに分割（ビュー）、端数は別に計算
+        n_full = len(x) // hop_length
+        blocks = [x[:n_full * hop_length].reshape(n_full, hop_length)]
+        if len(x) > n_full * hop_length:
+            blocks.append(x[n_full * hop_length:].reshape(1, -1))
+        
+        # 信号全体の長さの一時配列（abs・二乗）を作らずに集計
+        block_peak = np.concatenate([np.maximum(b.max(axis=1), -b.min(axis=1)) for b in blocks])
+        block_sq = np.concatenate([np.einsum('ij,ij->i', b, b, dtype=np.float64) for b in blocks])
+        return block_peak, block_sq
+
+
+def _fused_mono_stats(x, frame_length=2048, hop_length=512):
+    """ピーク値とフレームRMSを1パスで計算
+
+    フレームRMSは librosa.feature.rms（center=True）と同じ値。
+    frame_length は hop_length の倍数であること。
+    """
+    block_peak, block_sq = _block_stats(x, hop_length)
+    
+    # 中央揃えのフレームtは、ブロック t-k/2 〜 t+k/2-1 の二乗和（範囲外は0）
+    k = frame_length // hop_length
+    n_frames = 1 + len(x) // hop_length
+    frame_sq = np.convolve(block_sq, np.ones(k))[k // 2 - 1:k // 2 - 1 + n_frames]
+    rms_frames = np.sqrt(frame_sq / frame_length)
+    
+    return float(np.max(block_peak)), rms_frames
+
+
+def _dynamic_range_from_rms(rms_values):
+    """フレームRMSから動的範囲（95パーセンタイル - 10パーセンタイル）を計算"""
+    rms_db = _to_db(rms_values)
+    
+    # 2つのパーセンタイルを1回の部分ソート（np.partition）でまとめて計算
+    percentile_10, percentile_95 = np.percentile(rms_db, [10, 95])
+    
+    return percentile_95 - percentile_10
+
+
+# 楽器別解析の対象（キー: (周波数帯域, 楽器名)）
+INSTRUMENT_BANDS = {
+    'vocals': ((200, 4000), 'ボーカル'),
+    'kick': ((40, 100), 'キック'),
+    'snare': ((150, 250), 'スネア'),
+    'bass': ((60, 250), 'ベース'),
+    'guitar': ((200, 5000), 'ギター')
+}
+
+
+# 楽器別解析結果（1行1楽器の構造化配列）
+INSTRUMENT_DTYPE = np.dtype([
+    ('key', 'U16'),
+    ('name', 'U16'),
+    ('freq_lo', 'f4'),
+    ('freq_hi', 'f4'),
+    ('rms_db', 'f4'),
+    ('peak_db', 'f4'),
+    ('spectral_centroid', 'f4')
+])
+
+
+def instruments_to_dict(instruments):
+    """楽器別解析結果（構造化配列）を保存用の辞書（キー -> 指標）に変換"""
+    records = {}
+    # tolist() で各行をPythonの型（str, float）のタプルとして取り出す
+    for key, name, freq_lo, freq_hi, rms_db, peak_db, spectral_centroid in instruments.tolist():
+        records[key] = {
+            'name': name,
+            'freq_range': [freq_lo, freq_hi],
+            'rms_db': rms_db,
+            'peak_db': peak_db,
+            'spectral_centroid': spectral_centroid
+        }
+    return records
+
+
+@lru_cache(maxsize=128)
+def _band_bins(n_fft, sr, low, high):
+    """STFTのうち帯域 [low, high) に入るビンの範囲（スライス）と各ビンの周波数"""
+    freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+    start, stop = np.searchsorted(freqs, (low, high))
+    band_freqs = freqs[start:stop]
+    band_freqs.flags.writeable = False  # キャッシュ共有のため変更不可に
+    return slice(start, stop), band_freqs
+
+
+def _band_centroid(band_mag, band_freqs):
+    """帯域内のビンのみで重み付き平均したスペクトル重心のフレーム平均（無音フレームは0、librosaと同じ扱い）"""
+    total = band_mag.sum(axis=0)
+    centroids = np.divide(band_freqs @ band_mag, total,
+                          out=np.zeros(total.shape), where=total > 0)
+    return np.mean(centroids)
+
+
+@lru_cache(maxsize=128)
+def _design_bp_sos(sr, low, high):
+    """バンドパスフィルター係数（4次Butterworth、SOS形式）。帯域がナイキスト外ならNone"""
+    # ナイキスト直下の急峻なフィルターを避けるため上限は 0.45*sr までに制限
+    high = min(high, 0.45 * sr)
+    low = max(low, 10.0)
+    if high <= low:
+        return None
+    
+    return signal.butter(4, [low, high], btype='band', output='sos', fs=sr)
+
+
+if HAS_NUMBA:
+    @njit(cache=True, fastmath=True, nogil=True)
+    def _sosfilt(sos, x):
+        """SOSフィルター（転置直接形II、全セクションを1ループで処理、内部状態はfloat64）"""
+        n_sections = sos.shape[0]
+        out = np.empty_like(x)
+        z = np.zeros((n_sections, 2))
+        for i in range(x.shape[0]):
+            v = float(x[i])
+            for s in range(n_sections):
+                y = sos[s, 0] * v + z[s, 0]
+                z[s, 0] = sos[s, 1] * v - sos[s, 4] * y + z[s, 1]
+                z[s, 1] = sos[s, 2] * v - sos[s, 5] * y
+                v = y
+            out[i] = v
+        return out
+else:
+    def _sosfilt(sos, x):
+        """SOSフィルター"""
+        # 係数を音源（float32）と型を揃え、float64への昇格を防ぐ
+        return signal.sosfilt(sos.astype(np.float32), x, axis=-1)
+
+
 class AudioAnalyzer:
     """オーディオ解析メインクラス"""
     
+    # 1/4に間引いた信号で解析できる上限（間引き後のサンプリングレートに対する比率）
+    # 間引き用FIRの通過帯域（減衰0.03dB以内）に収まる範囲
+    DS4_MAX_RATIO = 0.4
+    
     def __init__(self, audio_path, sr=44100):
         self.audio_path = audio_path
         self.target_sr = sr
         self.y = None
         self.sr = None
         self.duration = None
+        self._is_mono = False
+        self._mono = None
+        self._mono_ds4 = None  # 1/4に間引いたモノラル信号
+        self._sr_ds4 = None
         self.load_audio()
     
     def load_audio(self):
         """音源読み込み"""
-        self.y, self.sr = librosa.load(self.audio_path, sr=self.target_sr, mono=False)
+        try:
+            # libsndfileで直接デコード（WAV/MP3等）し、必要な場合のみリサンプリング
+            data, native_sr = sf.read(self.audio_path, dtype='float32', always_2d=True)
+            self.y = np.ascontiguousarray(data.T)
+            if native_sr != self.target_sr:
+                self.y = librosa.resample(self.y, orig_sr=native_sr, target_sr=self.target_sr)
+            self.sr = self.target_sr
+        except RuntimeError:
+            # soundfileで読めない形式はlibrosaで読み込み
+            self.y, self.sr = librosa.load(self.audio_path, sr=self.target_sr, mono=False)
+        
+        # 以降の解析は全てfloat32・C連続の配列を前提とする（既に満たす場合はコピーなし）
+        self.y = np.ascontiguousarray(self.y, dtype=np.float32)
+        
+        # モノラル音源は複製せず1チャンネル（1, サンプル数）のまま保持
         if len(self.y.shape) == 1:
-            self.y = np.stack([self.y, self.y])
-        self.duration = librosa.get_duration(y=self.y, sr=self.sr)
+            self.y = self.y[np.newaxis]
+        self._is_mono = self.y.shape[0] == 1
+        self.duration = self.y.shape[-1] / self.sr
+        
+        # モノラル信号と、低・中域の楽器解析用に1/4へ間引いた信号を1回だけ作成
+        self._mono = self.y[0] if self._is_mono else np.mean(self.y, axis=0)
+        self._mono_ds4 = signal.decimate(self._mono, 4, ftype='fir', zero_phase=True).astype(np.float32)
+        self._sr_ds4 = self.sr / 4
+    
+    def close(self):
+        """音声データを解放（解析結果の取得後に呼ぶ）"""
+        self.y = None
+        self._mono = None
+        self._mono_ds4 = None
     
     def analyze_2mix(self):
         """2mix全体解析"""
-        mono = np.mean(self.y, axis=0)
+        mono = self._mono
         
-        # 基本指標
-        rms = librosa.feature.rms(y=mono)[0]
-        rms_db = 20 * np.log10(np.mean(rms) + 1e-10)
+        # 基本指標（ピーク値・フレームRMSをまとめて計算し、動的範囲にも使用）
+        peak, rms = _fused_mono_stats(mono)
+        rms_db = _to_db(np.mean(rms))
         
-        peak = np.max(np.abs(mono))
-        peak_db = 20 * np.log10(peak + 1e-10)
+        peak_db = _to_db(peak)
         
         crest_factor = peak_db - rms_db
         
@@ -139,7 +377,7 @@ class AudioAnalyzer:
         band_energies = self.calculate_band_energies(mono)
         
         # 動的範囲
-        dynamic_range = self.calculate_dynamic_range(mono)
+        dynamic_range = _dynamic_range_from_rms(rms)
         
         return {
             'rms_db': float(rms_db),
@@ -153,15 +391,18 @@ class AudioAnalyzer:
     
     def calculate_stereo_width(self):
         """ステレオ幅計算"""
-        if self.y.shape[0] < 2:
+        if self._is_mono:
             return 0.0
         
         L, R = self.y[0], self.y[1]
-        mid = (L + R) / 2
-        side = (L - R) / 2
         
-        mid_energy = np.sum(mid ** 2)
-        side_energy = np.sum(side ** 2)
+        # mid=(L+R)/2, side=(L-R)/2 を作らず内積3回でエネルギーを計算
+        # （L≈R で side が打ち消し合っても精度が落ちないようfloat64で累積）
+        lsq = np.einsum('i,i->', L, L, dtype=np.float64)
+        rsq = np.einsum('i,i->', R, R, dtype=np.float64)
+        lr = np.einsum('i,i->', L, R, dtype=np.float64)
+        mid_energy = (lsq + rsq + 2 * lr) / 4
+        side_energy = (lsq + rsq - 2 * lr) / 4
         
         if mid_energy + side_energy == 0:
             return 0.0
@@ -181,63 +422,94 @@ class AudioAnalyzer:
             'brilliance': (8000, 20000)
         }
         
+        # 1回のFFTで全帯域を計算（パーセバルの定理: 帯域内のパワー和 = 帯域成分の二乗和）
+        n = len(audio)
+        n_fft = sp_fft.next_fast_len(n, real=True)
+        spectrum = sp_fft.rfft(audio, n=n_fft)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        freqs = sp_fft.rfftfreq(n_fft, 1 / self.sr)
+        
         energies = {}
         for name, (low, high) in bands.items():
-            filtered = self.bandpass_filter(audio, low, high)
-            energy_db = 20 * np.log10(np.sqrt(np.mean(filtered ** 2)) + 1e-10)
+            # 周波数は昇順のため、帯域 [low, high) はスライスで取り出せる
+            start, stop = np.searchsorted(freqs, (low, high))
+            mean_square = 2 * np.sum(power[start:stop]) / (n_fft * n)
+            energy_db = _to_db(np.sqrt(mean_square))
             energies[name] = float(energy_db)
         
         return energies
     
-    def bandpass_filter(self, audio, low, high):
-        """バンドパスフィルター"""
-        nyq = self.sr / 2
-        low_norm = low / nyq
-        high_norm = high / nyq
-        
-        low_norm = np.clip(low_norm, 0.001, 0.999)
-        high_norm = np.clip(high_norm, 0.001, 0.999)
-        
-        if low_norm >= high_norm:
+    def bandpass_filter(self, audio, low, high, sr=None):
+        """バンドパスフィルター（sr省略時は読み込み時のサンプリングレート）"""
+        # 係数は (サンプリングレート, 帯域) ごとに1回だけ設計
+        sos = _design_bp_sos(sr or self.sr, low, high)
+        if sos is None:
             return audio * 0
         
-        try:
-            sos = signal.butter(4, [low_norm, high_norm], btype='band', output='sos')
-            return signal.sosfilt(sos, audio)
-        except:
-            return audio * 0
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        return _sosfilt(sos, audio)
     
     def calculate_dynamic_range(self, audio):
         """動的範囲計算"""
-        rms_values = librosa.feature.rms(y=audio, frame_length=2048, hop_length=512)[0]
-        rms_db = 20 * np.log10(rms_values + 1e-10)
-        
-        percentile_95 = np.percentile(rms_db, 95)
-        percentile_10 = np.percentile(rms_db, 10)
-        
-        return percentile_95 - percentile_10
+        _, rms_values = _fused_mono_stats(audio, frame_length=2048, hop_length=512)
+        return _dynamic_range_from_rms(rms_values)
     
-    def analyze_instrument(self, freq_range, instrument_name):
-        """楽器別解析"""
-        mono = np.mean(self.y, axis=0)
-        filtered = self.bandpass_filter(mono, freq_range[0], freq_range[1])
-        
-        # 基本指標
-        rms_db = 20 * np.log10(np.sqrt(np.mean(filtered ** 2)) + 1e-10)
-        peak_db = 20 * np.log10(np.max(np.abs(filtered)) + 1e-10)
+    def _uses_ds4(self, freq_range):
+        """間引いた信号で解析する帯域か（帯域上限が間引き用FIRの通過帯域内）"""
+        return freq_range[1] <= self._sr_ds4 * self.DS4_MAX_RATIO
+    
+    def _filter_instrument(self, freq_range):
+        """楽器の帯域を取り出した信号とそのサンプリングレート"""
+        # 帯域上限が十分低ければ間引いた信号で解析（処理するサンプル数が1/4）
+        if self._uses_ds4(freq_range):
+            mono, sr = self._mono_ds4, self._sr_ds4
+        else:
+            mono, sr = self._mono, self.sr
+        return self.bandpass_filter(mono, freq_range[0], freq_range[1], sr=sr), sr
+    
+    def analyze_instruments_batch(self, instruments=INSTRUMENT_BANDS):
+        """楽器別解析（スペクトログラムはサンプリングレートごとに1回だけ計算し、楽器間で共有）
+
+        instruments: {キー: (周波数帯域, 楽器名)}
+        戻り値: INSTRUMENT_DTYPE の構造化配列（1行1楽器）
+        """
+        # 帯域ごとのフィルター処理（sosfiltはGILを解放）をスレッドで並列実行し、STFTと並行させる
+        workers = min(len(instruments), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(self._filter_instrument, freq_range)
+                for key, (freq_range, _) in instruments.items()
+            }
+            
+            # スペクトル重心用のSTFTは間引いた信号で1回だけ計算（間引いた信号でフィルター処理した帯域に使用）
+            n_fft = 2048
+            mag = np.abs(librosa.stft(self._mono_ds4, n_fft=n_fft, hop_length=512))
+            
+            # 元のサンプリングレートで処理する帯域があれば、そのSTFTも1回だけ計算（振幅は帯域内のビンのみ使用）
+            spec_full = None
+            if not all(self._uses_ds4(freq_range) for freq_range, _ in instruments.values()):
+                spec_full = librosa.stft(self._mono, n_fft=n_fft, hop_length=512)
+            
+            filtered_signals = {key: future.result() for key, future in futures.items()}
         
-        # スペクトル重心
-        spectral_centroid = float(np.mean(
-            librosa.feature.spectral_centroid(y=filtered, sr=self.sr)[0]
-        ))
+        results = np.empty(len(instruments), dtype=INSTRUMENT_DTYPE)
+        for i, (key, (freq_range, instrument_name)) in enumerate(instruments.items()):
+            filtered, sr = filtered_signals[key]
+            
+            # フィルター処理と同じサンプリングレートのSTFTから、帯域内のビンのみで重心を計算
+            bins, band_freqs = _band_bins(n_fft, sr, *freq_range)
+            if sr == self._sr_ds4:
+                spectral_centroid = _band_centroid(mag[bins], band_freqs)
+            else:
+                spectral_centroid = _band_centroid(np.abs(spec_full[bins]), band_freqs)
+            
+            peak, rms = _peak_and_rms(filtered)
+            results[i] = (
+                key, instrument_name, freq_range[0], freq_range[1],
+                _to_db(rms), _to_db(peak), spectral_centroid
+            )
         
-        return {
-            'name': instrument_name,
-            'freq_range': freq_range,
-            'rms_db': float(rms_db),
-            'peak_db': float(peak_db),
-            'spectral_centroid': spectral_centroid
-        }
+        return results
 
 
 def generate_recommendations(analysis_data, metadata):
@@ -308,8 +580,17 @@ def generate_recommendations(analysis_data, metadata):
 
 
 def plot_frequency_response(band_energies):
-    """周波数特性グラフ"""
-    fig, ax = plt.subplots(figsize=(10, 5))
+    """周波数特性グラフ（セッションごとに1つのFigureを再利用）"""
+    # pyplotに登録しないFigureをセッションに保持（再実行のたびに作り直さない）
+    # セッション間で共有すると同時描画で競合するため、st.cache_resourceは使わない
+    fig = st.session_state.get('freq_response_fig')
+    if fig is None:
+        fig = Figure(figsize=(10, 5))
+        fig.add_subplot()
+        st.session_state.freq_response_fig = fig
+    
+    ax = fig.axes[0]
+    ax.clear()
     
     bands = list(band_energies.keys())
     energies = list(band_energies.values())
@@ -322,8 +603,8 @@ def plot_frequency_response(band_energies):
     ax.set_title('Frequency Band Energy Distribution', fontsize=14, fontweight='bold')
     ax.legend()
     ax.grid(True, alpha=0.3)
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    fig.tight_layout()
     
     return fig
 
@@ -338,9 +619,9 @@ def main():
     # セッションステート初期化
     init_session_state()
     
-    # データベース初期化
-    user_db = UserDatabase()
-    audio_db = UserAudioDatabase()
+    # データベース（プロセス内で共有）
+    user_db = get_user_db()
+    audio_db = get_audio_db()
     
     # 認証チェック
     if not st.session_state.authenticated:
@@ -406,6 +687,9 @@ def main():
             st.session_state.page = 'login'
             st.rerun()
     
+    # バックグラウンド保存の結果
+    show_save_status()
+    
     # メインコンテンツ
     if menu == "🎵 音源解析":
         show_analyzer_page(user, user_db, audio_db)
@@ -523,28 +807,28 @@ def show_upload_section(user, user_db, audio_db):
             with st.spinner("解析中..."):
                 try:
                     # 一時ファイルに保存
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
+                    # 拡張子を元ファイルに合わせる（デコーダーの形式判定用）
+                    suffix = Path(uploaded_file.name).suffix or '.wav'
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
                         tmp_file.write(uploaded_file.getvalue())
                         tmp_path = tmp_file.name
                     
-                    # 解析実行
-                    analyzer = AudioAnalyzer(tmp_path)
-                    analysis_result = analyzer.analyze_2mix()
-                    
-                    # 楽器別解析（簡易版）
-                    instruments = {
-                        'vocals': analyzer.analyze_instrument((200, 4000), 'ボーカル'),
-                        'kick': analyzer.analyze_instrument((40, 100), 'キック'),
-                        'snare': analyzer.analyze_instrument((150, 250), 'スネア'),
-                        'bass': analyzer.analyze_instrument((60, 250), 'ベース'),
-                        'guitar': analyzer.analyze_instrument((200, 5000), 'ギター')
-                    }
+                    try:
+                        # 解析実行
+                        analyzer = AudioAnalyzer(tmp_path)
+                        analysis_result = analyzer.analyze_2mix()
+                        
+                        # 楽器別解析（簡易版）
+                        instruments = analyzer.analyze_instruments_batch(INSTRUMENT_BANDS)
+                        
+                        # 音声データは解析後すぐに解放
+                        analyzer.close()
+                    finally:
+                        # 一時ファイル削除（解析エラー時も）
+                        os.unlink(tmp_path)
                     
                     analysis_result['instruments'] = instruments
                     
-                    # 一時ファイル削除
-                    os.unlink(tmp_path)
-                    
                     # メタデータ
                     metadata = {
                         'analysis_name': analysis_name,
@@ -560,11 +844,13 @@ def show_upload_section(user, user_db, audio_db):
                     st.session_state.analysis_result = analysis_result
                     st.session_state.analysis_metadata = metadata
                     
-                    # データベースに保存
-                    user_db.update_user_stats(user['email'])
-                    entry_id = audio_db.add_analysis(user['email'], analysis_result, metadata)
+                    # データベースに保存（ファイル書き込みはバックグラウンドで実行、結果は次回表示時に通知）
+                    stored_result = {**analysis_result, 'instruments': instruments_to_dict(instruments)}
+                    st.session_state.pending_saves.append(
+                        save_analysis_async(user_db, audio_db, user['email'], stored_result, metadata)
+                    )
                     
-                    st.success(f"✅ 解析完了！（ID: {entry_id}）")
+                    st.success("✅ 解析完了！（解析データを保存しています）")
                     st.balloons()
                     
                 except Exception as e:
@@ -612,14 +898,13 @@ def show_analysis_results():
     
     fig = plot_frequency_response(result['band_energies'])
     st.pyplot(fig)
-    plt.close(fig)
     
     # 楽器別
     if 'instruments' in result:
         st.markdown("---")
         st.markdown("#### 🎸 楽器別解析")
         
-        for inst_name, inst_data in result['instruments'].items():
+        for inst_data in result['instruments']:
             with st.expander(f"🎵 {inst_data['name']}", expanded=False):
                 col1, col2, col3 = st.columns(3)
                 
@@ -666,7 +951,7 @@ def show_history_page(user, audio_db):
     st.markdown("## 📊 過去の解析データ")
     
     # ユーザーの解析データ取得
-    analyses = audio_db.get_user_analyses(user['email'])
+    analyses = load_user_analyses(audio_db, user['email'])
     
     if not analyses:
         st.info("まだ解析データがありません。「音源解析」から解析を実行してください。")
@@ -691,16 +976,16 @@ def show_history_page(user, audio_db):
     
     # データ一覧
     for analysis in filtered:
-        timestamp = datetime.fromisoformat(analysis['timestamp'])
+        timestamp = analysis['timestamp']
         name = analysis['metadata'].get('analysis_name', '名称未設定')
         venue = analysis['metadata'].get('venue', '不明')
         
-        with st.expander(f"🎵 {name} - {venue} ({timestamp.strftime('%Y/%m/%d %H:%M')})", expanded=False):
+        with st.expander(f"🎵 {name} - {venue} ({fmt_ts(timestamp, '%Y/%m/%d %H:%M')})", expanded=False):
             col1, col2 = st.columns(2)
             
             with col1:
                 st.markdown("**📅 基本情報**")
-                st.write(f"**解析日時**: {timestamp.strftime('%Y年%m月%d日 %H:%M')}")
+                st.write(f"**解析日時**: {fmt_ts(timestamp, '%Y年%m月%d日 %H:%M')}")
                 st.write(f"**解析名**: {name}")
                 st.write(f"**会場**: {venue}")
                 st.write(f"**キャパ**: {analysis['metadata'].get('venue_capacity', '不明')}人")
@@ -736,6 +1021,7 @@ def show_history_page(user, audio_db):
             # 削除ボタン
             if st.button(f"🗑️ このデータを削除", key=f"delete_{analysis['id']}"):
                 if audio_db.delete_analysis(user['email'], analysis['id']):
+                    load_user_analyses.clear()
                     st.success("削除しました")
                     st.rerun()
                 else:
@@ -85,7 +85,7 @@ def create_config():
     
     if not config_path.exists():
         with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+            f.write(json.dumps(config, ensure_ascii=False, indent=2))
         print("  ✓ config.json を作成しました")
     else:
         print("  • config.json は既に存在します")